@@ -3,7 +3,250 @@ Custom Implementation of retrieval of tweets using the X (formerly Twitter) API
 For more details, visit https://rapidapi.com/alexanderxbx/api/twitter-api45/
 
 """
-import requests
+import asyncio
+import importlib.util
+import threading
+import time
+
+import httpx
+import orjson
+from cachetools import LRUCache, TTLCache
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
+
+_BASE = "https://twitter-api45.p.rapidapi.com"
+_URL_LATEST_REPLIES = _BASE + "/latest_replies.php"
+_URL_RETWEETS = _BASE + "/retweets.php"
+_URL_SEARCH = _BASE + "/search.php"
+_URL_TWEET = _BASE + "/tweet.php"
+_URL_TWEET_THREAD = _BASE + "/tweet_thread.php"
+_URL_SCREENNAME = _BASE + "/screenname.php"
+_URL_TIMELINE = _BASE + "/timeline.php"
+
+# HTTP/2 needs the optional h2 package (httpx[http2]), otherwise the async client falls back to HTTP/1.1
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_SEARCH_TYPES = frozenset({"", "TOP", "LATEST", "MEDIA", "PEOPLE", "LISTS"})
+
+# In-process memo of tweet / user info, and the last successful response of every
+# endpoint call served when the API fails, shared by all APIX instances.
+# Both keep the raw JSON body, decoded again on every hit so that callers never
+# share (and may freely mutate) the returned data.
+# Stale entries are (body, fetch time, size) and the whole fallback is bounded
+# by the size of the response bodies.
+_memo = TTLCache(maxsize = 4096, ttl = 600)
+_STALE_MAX_BYTES = 64 * 1024 * 1024
+_STALE_MAX_AGE = 86400
+_stale = LRUCache(maxsize = _STALE_MAX_BYTES, getsizeof = lambda entry: entry[2])
+_memo_lock = threading.Lock()
+
+# Server errors retried by the adapter, each attempt taking a token from the bucket
+_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+class APIError(Exception):
+    """
+    Raised when the API fails (HTTP 5xx) and no previous response can be served instead.
+
+    Attributes
+    ----------
+    status_code : int
+        The HTTP status code returned by the API
+
+    """
+    def __init__(self, status_code, message = None):
+        self.status_code = status_code
+        super().__init__(message or "The API responded with HTTP %d" % status_code)
+
+class RateLimitError(APIError):
+    """
+    Raised when the API quota is exhausted (HTTP 429) and no previous response can be served instead.
+
+    Attributes
+    ----------
+    retry_after : str
+        The value of the Retry-After header returned by the API, if any
+
+    """
+    def __init__(self, retry_after = None):
+        self.retry_after = retry_after
+        super().__init__(429, "Rate limit of the API exceeded (Retry-After: %s)" % retry_after)
+
+def _cache_key(url, params):
+    return (url, tuple(sorted(params.items())))
+
+def _decode(response, cache_key):
+    """
+    Decodes the JSON body of an endpoint response (requests or httpx) with orjson.
+
+    Successful responses are remembered under cache_key, and served back when the
+    API later responds to the same call with HTTP 429 or 5xx, for up to _STALE_MAX_AGE seconds.
+
+    Returns
+    -------
+    the decoded data, and the raw body when it is a fresh successful (2xx) response (None otherwise).
+
+    """
+    if response.status_code == 429 or response.status_code >= 500:
+        with _memo_lock:
+            entry = _stale.get(cache_key)
+        if entry is not None and time.time() - entry[1] < _STALE_MAX_AGE:
+            return orjson.loads(entry[0]), None
+        if response.status_code == 429:
+            raise RateLimitError(response.headers.get("Retry-After"))
+        raise APIError(response.status_code)
+
+    body = response.content
+    data = orjson.loads(body)
+    if not 200 <= response.status_code < 300:
+        return data, None
+    # An expired response served by requests-cache (stale_if_error) is not fresh either
+    if getattr(response, "from_cache", False) and getattr(response, "is_expired", False):
+        return data, None
+    if len(body) <= _STALE_MAX_BYTES:
+        with _memo_lock:
+            _stale[cache_key] = (body, time.time(), len(body))
+    return data, body
+
+def _validate_id(id):
+    """
+    Raises ValueError when the tweet id is not a string of ASCII digits.
+
+    """
+    if not (isinstance(id, str) and id.isascii() and id.isdigit()):
+        raise ValueError("Invalid Tweet ID")
+
+def _tweet_params(id, cursor = None):
+    """
+    Validates the tweet id and builds the parameters of the tweet endpoints.
+
+    """
+    _validate_id(id)
+    params = {"id": id}
+    if (cursor != None):
+        params["cursor"] = cursor
+    return params
+
+def _search_params(keyword, search_type, cursor):
+    """
+    Validates the search_type and builds the parameters of the search endpoint.
+
+    """
+    search_type = search_type.upper() if search_type else ""
+    if search_type not in _SEARCH_TYPES:
+        raise ValueError("Invalid search_type. The search_type does not belong to [TOP, LATEST, MEDIA, PEOPLE, LISTS] ")
+
+    params = {"query": keyword}
+    if search_type:
+        params["search_types"] = search_type
+    if (cursor != None):
+        params["cursor"] = cursor
+    return params
+
+def _user_params(screenname, twitter_id, cursor = None):
+    """
+    Builds the parameters of the user endpoints.
+
+    """
+    params = {"screenname": screenname}
+    if (twitter_id != None):
+        params["rest_id"] = twitter_id
+    if (cursor != None):
+        params["cursor"] = cursor
+    return params
+
+class TokenBucket:
+    """
+    Token bucket limiting the number of requests sent to the API per minute.
+
+    Attributes
+    ----------
+    rate : int
+        The number of requests allowed per minute, also the capacity of the bucket
+    request_tokens : float
+        The number of tokens currently available
+    last_update : float
+        The monotonic time at which the tokens were last refilled
+
+    """
+    rate : int
+    request_tokens : float
+    last_update : float
+
+    def __init__(self, rate):
+        """
+        Initializes a full TokenBucket
+
+        Parameters
+        ----------
+        rate : int
+            The number of requests allowed per minute
+
+        """
+        self.rate = rate
+        self.request_tokens = rate
+        self.last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """
+        Takes a token from the bucket, possibly borrowing it ahead of the refill.
+
+        Returns
+        -------
+        the number of seconds to wait before the token is actually available.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.last_update
+            self.request_tokens = min(self.rate, self.request_tokens + elapsed * self.rate / 60)
+            self.last_update = now
+            self.request_tokens -= 1
+            return max(0, -self.request_tokens * 60 / self.rate)
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, sleeping until one is refilled if the bucket is empty.
+
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """
+        Asynchronous version of acquire, waiting for the refill without blocking the event loop.
+
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that takes a token from the bucket before every request sent over the network.
+
+    Mounted on the CachedSession, it only sees cache misses, so cached responses
+    are not counted against the API quota. Server errors (5xx) are retried here,
+    so that every attempt takes its own token; HTTP 429 is handed back at once.
+
+    """
+    def __init__(self, bucket, status_retries = 3, backoff_factor = 0.3, **kwargs):
+        self.bucket = bucket
+        self.status_retries = status_retries
+        self.backoff_factor = backoff_factor
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.status_retries + 1):
+            self.bucket.acquire()
+            response = super().send(request, **kwargs)
+            if response.status_code not in _RETRY_STATUSES or attempt == self.status_retries:
+                return response
+            response.close()
+            time.sleep(self.backoff_factor * 2 ** attempt)
 
 class APIX:
     """
@@ -19,8 +262,13 @@ class APIX:
         The host URL of the X - RapidAPI (default is: twitter-api45.p.rapidapi.com)
     APIheaders : dict
         A key-value pair of API key and API host
-    params : dict
-        The parameters to be passed to access the endpoint.
+    session : requests_cache.CachedSession
+        A pooled HTTP session reused across all the endpoint calls (keep-alive),
+        backed by an on-disk SQLite cache of the responses
+    bucket : TokenBucket
+        The token bucket limiting the requests that miss the cache
+    max_concurrency : int
+        The maximum number of asynchronous endpoint calls in flight at once
 
     Methods
     -------
@@ -45,13 +293,33 @@ class APIX:
     getUserTimeline(screenname, twitter_id = None, cursor = None)
         Returns user's latest tweets by its screenname.
 
+    close()
+        Closes the underlying HTTP session and its pooled connections.
+
+    aGetLatestReplies(id), aGetRetweets(id), aSearchTweet(keyword, search_type = "", cursor = None),
+    aGetTweetInfo(id), aGetTweetThread(id, cursor = None), aGetUserInfo(screenname, twitter_id = None),
+    aGetUserTimeline(screenname, twitter_id = None, cursor = None)
+        Asynchronous versions of the endpoint methods, to be awaited (e.g. with asyncio.gather).
+        They share the token bucket of the synchronous methods, and may be run from
+        several event loops (e.g. successive asyncio.run calls).
+
+    aclose()
+        Closes the asynchronous HTTP client of the running event loop. It should be awaited
+        before the loop ends, otherwise the client of the closed loop is only dropped (and its
+        sockets left to the garbage collector) by the next asynchronous call.
+
+    When the API responds with HTTP 429 or 5xx, the endpoint methods return the last
+    successful response to the same call, or raise RateLimitError / APIError if there is none.
+
     """
     key : str
     host : str
     APIheaders : dict
-    params : dict
+    session : CachedSession
+    bucket : TokenBucket
+    max_concurrency : int
 
-    def __init__(self, key, host = "twitter-api45.p.rapidapi.com"):
+    def __init__(self, key, host = "twitter-api45.p.rapidapi.com", cache_name = "apix_cache", rate_limit = 60, max_concurrency = 8):
         """
         Initializes the APIX object
 
@@ -62,14 +330,179 @@ class APIX:
         host : str 
             The host URL of the X - RapidAPI 
             (Default: twitter-api45.p.rapidapi.com)
+        cache_name : str
+            The name of the SQLite database used to cache the responses of the endpoints,
+            stored in the user cache directory (e.g. ~/.cache/apix_cache.sqlite) unless it is an absolute path.
+            (Default: apix_cache)
+        rate_limit : int
+            The maximum number of requests sent to the API per minute. Cached responses are not counted.
+            (Default: 60)
+        max_concurrency : int
+            The maximum number of asynchronous endpoint calls in flight at once.
+            (Default: 8)
+
+        Raises
+        ------
+        ValueError:
+            When rate_limit is not a positive number
 
         """
+        if not rate_limit > 0:
+            raise ValueError("Invalid rate_limit. The rate_limit must be greater than 0")
+
         self.key = key
         self.host = host
         self.APIheaders = {}
         self.APIheaders["X-RapidAPI-Key"] = key
         self.APIheaders["X-RapidAPI-Host"] = host
 
+        # urllib3 only retries failed connections, which never reach the API (no status retries,
+        # not even on Retry-After); server errors are retried by the adapter, and 429 is answered
+        # from the stale fallback
+        retries = Retry(
+            total = 3,
+            read = 0,
+            status = 0,
+            respect_retry_after_header = False,
+            raise_on_status = False,
+            backoff_factor = 0.3,
+        )
+        self.bucket = TokenBucket(rate_limit)
+        adapter = RateLimitedAdapter(self.bucket, pool_connections = 1, pool_maxsize = 16, max_retries = retries)
+
+        # Tweet and user info rarely change, replies and timelines do
+        self.session = CachedSession(
+            cache_name,
+            backend = "sqlite",
+            expire_after = 3600,
+            urls_expire_after = {
+                "*/tweet.php": 86400,
+                "*/screenname.php": 43200,
+                "*/latest_replies.php": 120,
+                "*/timeline.php": 300,
+            },
+            allowable_methods = ["GET"],
+            stale_if_error = _STALE_MAX_AGE,
+            # Keeps the API key out of the stored requests and of the cache keys
+            ignored_parameters = ["X-RapidAPI-Key"],
+            use_cache_dir = True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.APIheaders)
+
+        self.max_concurrency = max_concurrency
+        # The async client and the semaphore are bound to an event loop, so each loop gets its own
+        self._loops = {}
+
+    def close(self):
+        """
+        Closes the underlying HTTP session and releases its pooled connections.
+
+        """
+        self.session.close()
+
+    async def aclose(self):
+        """
+        Closes the asynchronous HTTP client of the running event loop and releases its connections.
+
+        """
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+    def _loopState(self):
+        """
+        Returns the asynchronous HTTP client and the concurrency semaphore of the running event loop,
+        creating them on its first asynchronous call.
+
+        Over HTTP/2 (when h2 is installed) the calls of a loop are multiplexed over one connection.
+
+        The state of loops closed without aclose() is dropped here: their clients cannot be
+        closed any more, since closing needs the loop they are bound to.
+
+        """
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            for closed in [other for other in self._loops if other.is_closed()]:
+                del self._loops[closed]
+            client = httpx.AsyncClient(
+                http2 = _HTTP2,
+                headers = self.APIheaders,
+                base_url = _BASE,
+                limits = httpx.Limits(max_keepalive_connections = 8, max_connections = 32),
+                timeout = httpx.Timeout(10.0, connect = 3.0),
+            )
+            state = self._loops[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return state
+
+    def _get(self, url, params):
+        """
+        Accesses the endpoint through the cached, rate-limited session.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the endpoint to be accessed.
+        params : dict
+            The parameters to be passed to access the endpoint.
+
+        Raises
+        ------
+        RateLimitError:
+            When the API quota is exhausted and the call was never answered successfully before
+        APIError:
+            When the API fails and the call was never answered successfully before
+
+        Returns
+        -------
+        response in JSON format after successful access of the endpoint,
+        or the last successful one when the API fails.
+
+        """
+        return self._fetch(url, params)[0]
+
+    def _fetch(self, url, params):
+        """
+        Same as _get, also returning the raw body when the data is a fresh successful response.
+
+        """
+        try:
+            response = self.session.get(url, params = params, timeout = (3.05, 10))
+        except HTTPError as error:
+            # Raised by requests-cache when its expired entry is too old for stale_if_error
+            response = error.response
+        return _decode(response, _cache_key(url, params))
+
+    def _memoizedGet(self, url, params):
+        """
+        Returns the decoded response of the endpoint, served from the in-process memo when present.
+        Only fresh successful responses are memoized.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the endpoint to be accessed.
+        params : dict
+            The parameters to be passed to access the endpoint.
+
+        Returns
+        -------
+        response in JSON format, either memoized or after successful access of the endpoint.
+
+        """
+        cache_key = _cache_key(url, params)
+        with _memo_lock:
+            body = _memo.get(cache_key)
+        if body is not None:
+            return orjson.loads(body)
+
+        data, body = self._fetch(url, params)
+        if body is not None:
+            with _memo_lock:
+                _memo[cache_key] = body
+        return data
+
     def getLatestReplies(self, id : str):
         """
         Gets the Latest Replies of the tweet
@@ -89,17 +522,7 @@ class APIX:
         response in JSON format after successful access of the latest_replies endpoint.
 
         """
-        try:
-            id_int = int(id)
-        except ValueError:
-            raise ValueError("Invalid Tweet ID")
-        self.params = {}
-        self.params["id"] = id
-
-        url = "https://twitter-api45.p.rapidapi.com/latest_replies.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._get(_URL_LATEST_REPLIES, _tweet_params(id))
     
     def getRetweets(self, id : str):
         """
@@ -120,17 +543,7 @@ class APIX:
         response in JSON format after successful access of the retweets endpoint.
         
         """
-        try:
-            id_int = int(id)
-        except ValueError:
-            raise ValueError("Invalid Tweet ID")
-        self.params = {}
-        self.params["id"] = id
-
-        url = "https://twitter-api45.p.rapidapi.com/retweets.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._get(_URL_RETWEETS, _tweet_params(id))
     
     def searchTweet(self, keyword : str, search_type : str = "", cursor : str = None):
         """
@@ -158,22 +571,7 @@ class APIX:
         response in JSON format after successful access of the search endpoint.
         
         """
-        search_type = search_type.upper()
-        types = set(["TOP", "LATEST", "MEDIA", "PEOPLE", "LISTS"])
-        if search_type not in types and search_type != "":
-            raise ValueError("Invalid search_type. The search_type does not belong to [TOP, LATEST, MEDIA, PEOPLE, LISTS] ")
-        
-        self.params = {}
-        self.params["query"] = keyword
-        if search_type in types:
-            self.params["search_types"] = search_type
-        if (cursor != None):
-            self.params["cursor"] = cursor
-        
-        url = "https://twitter-api45.p.rapidapi.com/search.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._get(_URL_SEARCH, _search_params(keyword, search_type, cursor))
     
     def getTweetInfo(self, id : str):
         """
@@ -194,17 +592,7 @@ class APIX:
         response in JSON format after successful access of the tweet endpoint.
         
         """
-        try:
-            id_int = int(id)
-        except ValueError:
-            raise ValueError("Invalid Tweet ID")
-        self.params = {}
-        self.params["id"] = id
-
-        url = "https://twitter-api45.p.rapidapi.com/tweet.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._memoizedGet(_URL_TWEET, _tweet_params(id))
     
     def getTweetThread(self, id : str, cursor : str = None):
         """
@@ -228,19 +616,7 @@ class APIX:
         response in JSON format after successful access of the tweet_thread endpoint.
         
         """
-        try:
-            id_int = int(id)
-        except ValueError:
-            raise ValueError("Invalid Tweet ID")
-        self.params = {}
-        self.params["id"] = id
-        if (cursor != None):
-            self.params["cursor"] = cursor
-
-        url = "https://twitter-api45.p.rapidapi.com/tweet_thread.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._get(_URL_TWEET_THREAD, _tweet_params(id, cursor))
     
     def getUserInfo(self, screenname : str, twitter_id : str = None):
         """
@@ -259,15 +635,7 @@ class APIX:
         response in JSON format after successful access of the screenname endpoint.
 
         """
-        self.params = {}
-        self.params["screenname"] = screenname
-        if (twitter_id != None):
-            self.params["rest_id"] = twitter_id
-
-        url = "https://twitter-api45.p.rapidapi.com/screenname.php"
-
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
+        return self._memoizedGet(_URL_SCREENNAME, _user_params(screenname, twitter_id))
     
     def getUserTimeline(self, screenname : str, twitter_id : str = None, cursor : str = None):
         """
@@ -289,14 +657,107 @@ class APIX:
         response in JSON format after successful access of the timeline endpoint.
 
         """
-        self.params = {}
-        self.params["screenname"] = screenname
-        if (twitter_id != None):
-            self.params["rest_id"] = twitter_id
-        if (cursor != None):
-            self.params["cursor"] = cursor
+        return self._get(_URL_TIMELINE, _user_params(screenname, twitter_id, cursor))
+
+    async def _aGet(self, url, params):
+        """
+        Accesses the endpoint asynchronously, bounded by the concurrency limit and the token bucket.
 
-        url = "https://twitter-api45.p.rapidapi.com/timeline.php"
+        Parameters
+        ----------
+        url : str
+            The URL of the endpoint to be accessed.
+        params : dict
+            The parameters to be passed to access the endpoint.
+
+        Raises
+        ------
+        RateLimitError:
+            When the API quota is exhausted and the call was never answered successfully before
+        APIError:
+            When the API fails and the call was never answered successfully before
+
+        Returns
+        -------
+        response in JSON format after successful access of the endpoint,
+        or the last successful one when the API fails.
+
+        """
+        return (await self._aFetch(url, params))[0]
+
+    async def _aFetch(self, url, params):
+        """
+        Asynchronous version of _fetch.
+
+        """
+        client, semaphore = self._loopState()
+        async with semaphore:
+            await self.bucket.aacquire()
+            response = await client.get(url, params = params)
+        return _decode(response, _cache_key(url, params))
+
+    async def _aMemoizedGet(self, url, params):
+        """
+        Asynchronous version of _memoizedGet, sharing the same in-process memo.
+
+        """
+        cache_key = _cache_key(url, params)
+        with _memo_lock:
+            body = _memo.get(cache_key)
+        if body is not None:
+            return orjson.loads(body)
+
+        data, body = await self._aFetch(url, params)
+        if body is not None:
+            with _memo_lock:
+                _memo[cache_key] = body
+        return data
+
+    async def aGetLatestReplies(self, id : str):
+        """
+        Asynchronous version of getLatestReplies.
+
+        """
+        return await self._aGet(_URL_LATEST_REPLIES, _tweet_params(id))
+
+    async def aGetRetweets(self, id : str):
+        """
+        Asynchronous version of getRetweets.
+
+        """
+        return await self._aGet(_URL_RETWEETS, _tweet_params(id))
+
+    async def aSearchTweet(self, keyword : str, search_type : str = "", cursor : str = None):
+        """
+        Asynchronous version of searchTweet.
+
+        """
+        return await self._aGet(_URL_SEARCH, _search_params(keyword, search_type, cursor))
+
+    async def aGetTweetInfo(self, id : str):
+        """
+        Asynchronous version of getTweetInfo.
+
+        """
+        return await self._aMemoizedGet(_URL_TWEET, _tweet_params(id))
 
-        response = requests.get(url, headers = self.APIheaders, params = self.params)
-        return response.json()
\ No newline at end of file
+    async def aGetTweetThread(self, id : str, cursor : str = None):
+        """
+        Asynchronous version of getTweetThread.
+
+        """
+        return await self._aGet(_URL_TWEET_THREAD, _tweet_params(id, cursor))
+
+    async def aGetUserInfo(self, screenname : str, twitter_id : str = None):
+        """
+        Asynchronous version of getUserInfo.
+
+        """
+        return await self._aMemoizedGet(_URL_SCREENNAME, _user_params(screenname, twitter_id))
+
+    async def aGetUserTimeline(self, screenname : str, twitter_id : str = None, cursor : str = None):
+        """
+        Asynchronous version of getUserTimeline.
+
+        """
+        return await self._aGet(_URL_TIMELINE, _user_params(screenname, twitter_id, cursor))
@@ -0,0 +1,292 @@
+import asyncio
+import datetime
+import http.server
+import io
+import threading
+import time
+
+import httpx
+import pytest
+import requests
+from urllib3 import HTTPResponse
+
+import customtwitter
+from customtwitter import APIX, HTTPAdapter, RateLimitError, TokenBucket
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic / time.time / time.sleep, sleeping advances the clock.
+
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeAPI:
+    """
+    Replaces the network below RateLimitedAdapter, answering with the queued responses.
+
+    """
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def queue(self, status, body = b"{}", headers = None):
+        self.responses.append((status, body, headers or {}))
+
+    def send(self, adapter, request, **kwargs):
+        self.requests.append(request)
+        status, body, headers = self.responses.pop(0)
+        raw = HTTPResponse(
+            body = io.BytesIO(body),
+            status = status,
+            headers = dict(headers, **{"Content-Type": "application/json"}),
+            preload_content = False,
+        )
+        return adapter.build_response(request, raw)
+
+
+@pytest.fixture(autouse = True)
+def clear_memo():
+    customtwitter._memo.clear()
+    customtwitter._stale.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(customtwitter.time, "monotonic", clock.time)
+    monkeypatch.setattr(customtwitter.time, "time", clock.time)
+    monkeypatch.setattr(customtwitter.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    fake_api = FakeAPI()
+    monkeypatch.setattr(HTTPAdapter, "send", lambda adapter, request, **kwargs: fake_api.send(adapter, request, **kwargs))
+    return fake_api
+
+
+@pytest.fixture
+def api(tmp_path, clock, fake_api):
+    api = APIX(key = "secret", cache_name = str(tmp_path / "apix_cache"))
+    yield api
+    api.close()
+
+
+def test_bucket_waits_once_empty(clock):
+    bucket = TokenBucket(60)
+    for _ in range(60):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+    clock.now += 30
+    for _ in range(30):
+        bucket.acquire()
+    assert len(clock.sleeps) == 1
+
+
+def test_rate_limit_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        APIX(key = "secret", cache_name = str(tmp_path / "apix_cache"), rate_limit = 0)
+
+
+def test_cache_hit_spends_no_token(api, fake_api):
+    fake_api.queue(200, b'{"retweets": []}')
+
+    assert api.getRetweets("1") == {"retweets": []}
+    assert api.getRetweets("1") == {"retweets": []}
+    assert len(fake_api.requests) == 1
+    assert api.bucket.request_tokens == pytest.approx(59)
+
+
+def test_server_errors_spend_one_token_per_attempt(api, clock, fake_api):
+    fake_api.queue(503)
+    fake_api.queue(502)
+    fake_api.queue(200, b'{"retweets": []}')
+
+    assert api.getRetweets("1") == {"retweets": []}
+    assert len(fake_api.requests) == 3
+    assert clock.sleeps == [pytest.approx(0.3), pytest.approx(0.6)]
+    # 3 tokens taken, 0.9 refilled during the backoff
+    assert api.bucket.request_tokens == pytest.approx(57.9)
+
+
+def test_rate_limited_call_serves_stale_response(api, clock, fake_api):
+    fake_api.queue(200, b'{"retweets": ["a"]}')
+    assert api.getRetweets("1") == {"retweets": ["a"]}
+    api.session.cache.clear()
+
+    fake_api.queue(429, b"<html>", {"Retry-After": "60"})
+    assert api.getRetweets("1") == {"retweets": ["a"]}
+    assert len(fake_api.requests) == 2
+    assert clock.sleeps == []
+
+
+def test_rate_limited_call_raises_without_stale_response(api, clock, fake_api):
+    fake_api.queue(429, b"<html>", {"Retry-After": "60"})
+
+    with pytest.raises(RateLimitError) as error:
+        api.getRetweets("1")
+    assert error.value.retry_after == "60"
+    assert len(fake_api.requests) == 1
+    assert clock.sleeps == []
+
+
+def test_memoized_result_is_not_shared(api, fake_api):
+    fake_api.queue(200, b'{"id": "1"}')
+
+    api.getTweetInfo("1")["id"] = "mutated"
+    assert api.getTweetInfo("1") == {"id": "1"}
+    assert len(fake_api.requests) == 1
+
+
+def test_sync_and_async_methods_share_validation(api):
+    with pytest.raises(ValueError):
+        api.searchTweet("BTC", search_type = "oldest")
+    with pytest.raises(ValueError):
+        asyncio.run(api.aSearchTweet("BTC", search_type = "oldest"))
+    for id in ("12a", "²", "١٢٣"):
+        with pytest.raises(ValueError):
+            api.getTweetThread(id)
+        with pytest.raises(ValueError):
+            asyncio.run(api.aGetTweetThread(id))
+
+
+def test_async_state_of_closed_loops_is_dropped(api, monkeypatch):
+    async def handler(request):
+        await asyncio.sleep(0)
+        return httpx.Response(200, json = {"retweets": []})
+
+    client = customtwitter.httpx.AsyncClient
+    monkeypatch.setattr(customtwitter.httpx, "AsyncClient",
+                        lambda **kwargs: client(transport = httpx.MockTransport(handler), **kwargs))
+
+    async def fan_out():
+        # More calls than max_concurrency, so that the semaphore gets contended
+        results = await asyncio.gather(*[api.aGetRetweets(str(id)) for id in range(10)])
+        assert results == [{"retweets": []}] * 10
+
+    for _ in range(3):
+        asyncio.run(fan_out())
+    assert len(api._loops) == 1
+
+    async def fan_out_and_close():
+        await fan_out()
+        await api.aclose()
+
+    asyncio.run(fan_out_and_close())
+    assert api._loops == {}
+
+
+@pytest.fixture
+def local_api(tmp_path):
+    """
+    Serves the queued (status, body, headers) responses over HTTP, through the real urllib3 stack.
+
+    """
+    responses = []
+    requests_seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            status, body, headers = responses.pop(0) if responses else (200, b"{}", {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    api = APIX(key = "secret", cache_name = str(tmp_path / "apix_cache"))
+    adapter = api.session.get_adapter(customtwitter._BASE)
+    adapter.backoff_factor = 0
+    session = requests.Session()
+    session.mount("http://", adapter)
+    url = "http://127.0.0.1:%d/retweets.php" % server.server_address[1]
+    yield session, url, responses, requests_seen
+
+    server.shutdown()
+    session.close()
+    api.close()
+
+
+def test_retry_after_is_not_retried_by_urllib3(local_api):
+    session, url, responses, requests_seen = local_api
+    responses.append((429, b"<html>", {"Retry-After": "60"}))
+
+    start = time.monotonic()
+    response = session.get(url, params = {"id": "1"})
+    with pytest.raises(RateLimitError):
+        customtwitter._decode(response, customtwitter._cache_key(url, {"id": "1"}))
+    assert time.monotonic() - start < 5
+    assert len(requests_seen) == 1
+
+    responses.append((200, b'{"retweets": ["a"]}', {}))
+    data, _ = customtwitter._decode(session.get(url, params = {"id": "1"}), customtwitter._cache_key(url, {"id": "1"}))
+    responses.append((429, b"<html>", {"Retry-After": "60"}))
+    data, _ = customtwitter._decode(session.get(url, params = {"id": "1"}), customtwitter._cache_key(url, {"id": "1"}))
+    assert data == {"retweets": ["a"]}
+    assert len(requests_seen) == 3
+
+
+def test_server_errors_are_only_retried_by_the_adapter(local_api):
+    session, url, responses, requests_seen = local_api
+    responses.extend([(503, b"<html>", {"Retry-After": "1"})] * 4)
+
+    response = session.get(url, params = {"id": "1"})
+    assert response.status_code == 503
+    assert len(requests_seen) == 4
+
+
+def test_expired_disk_cache_fallback_is_not_fresh(api, clock, fake_api):
+    key = (customtwitter._URL_TWEET, (("id", "1"),))
+    fake_api.queue(200, b'{"id": "1"}')
+    assert api.getTweetInfo("1") == {"id": "1"}
+    fetched_at = customtwitter._stale[key][1]
+
+    customtwitter._memo.clear()
+    expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes = 1)
+    api.session.cache.reset_expiration(expired)
+    clock.now += 3600
+    for _ in range(4):
+        fake_api.queue(503)
+
+    # Answered by requests-cache from its expired entry
+    assert api.getTweetInfo("1") == {"id": "1"}
+    assert len(fake_api.requests) == 5
+    assert len(customtwitter._memo) == 0
+    assert customtwitter._stale[key][1] == fetched_at
+
+
+def test_too_old_disk_cache_entry_falls_back_to_decode(api, fake_api):
+    fake_api.queue(200, b'{"retweets": ["a"]}')
+    assert api.getRetweets("1") == {"retweets": ["a"]}
+    customtwitter._stale.clear()
+
+    api.session.cache.reset_expiration(datetime.datetime(2000, 1, 1, tzinfo = datetime.timezone.utc))
+    fake_api.queue(429, b"<html>", {"Retry-After": "60"})
+
+    with pytest.raises(RateLimitError):
+        api.getRetweets("1")
+    assert len(fake_api.requests) == 2